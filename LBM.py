@@ -1,15 +1,20 @@
 import numpy as np
+import numba as nb
 import matplotlib.pyplot as plt
+from scipy.ndimage import map_coordinates
 from matplotlib.animation import FuncAnimation
-from scipy.interpolate import RegularGridInterpolator
 from matplotlib import colors
 import matplotlib.patches as mpatches
 import cv2
 
 # LBM constants
 c = np.array([(0, 0), (1, 0), (0, 1), (-1, 0), (0, -1), (1, 1),
-              (-1, 1), (-1, -1), (1, -1)])
-w = np.array([4/9, 1/9, 1/9, 1/9, 1/9, 1/36, 1/36, 1/36, 1/36])
+              (-1, 1), (-1, -1), (1, -1)], dtype=np.int8)
+w = np.array([4/9, 1/9, 1/9, 1/9, 1/9, 1/36, 1/36, 1/36, 1/36],
+             dtype=np.float64)
+# Index of the opposite direction of every velocity in c, for bounce back.
+opp = np.array([0, 3, 4, 1, 2, 7, 8, 5, 6], dtype=np.int8)
+opp_pairs = ((1, 3), (2, 4), (5, 7), (6, 8))
 Q = 9
 
 AIR, WALL, INLET, OUTLET, INFECTED, SUSCEPTIBLE = [0, 1, 2, 3, 4, 5]
@@ -20,8 +25,106 @@ susceptible_centroids = np.array([(18, 93), (79, 80), (79, 51), (80, 26),
 NUM_SUSCEP_CENTROIDS = len(susceptible_centroids)
 
 
+@nb.njit(parallel=True, fastmath=True, boundscheck=False, cache=True)
+def lbm_step(f_src, f_dst, rho, ux, uy, wall, tau):
+    """
+    Perform a single fused LBM step: moment update, BGK collision, streaming
+    and bounce back in one pass over the lattice.
+
+    The populations f_src and f_dst are stored with shape (Q, width, height),
+    so every direction is a contiguous plane.
+
+    The post-collision populations of every cell are pushed directly to the
+    neighbouring cells in f_dst. Populations that land on a wall cell are
+    stored in the opposite direction (bounce back). The macroscopic quantities
+    of f_src are written to rho, ux and uy, with the velocity set to zero at
+    the walls.
+
+    Returns the minimum equilibrium value, which should not be negative for
+    the simulation to be stable.
+    """
+    width, height = wall.shape
+
+    # Use constants of the floating point type of the lattice, so float32
+    # lattices are not computed in double precision.
+    real = f_src.dtype.type
+    one, three, four_half, one_half = real(1), real(3), real(4.5), real(1.5)
+    inv_tau = real(1 / tau)
+    f_eq_min = real(np.inf)
+
+    for x in nb.prange(width):
+        for y in range(height):
+            f0, f1, f2 = f_src[0, x, y], f_src[1, x, y], f_src[2, x, y]
+            f3, f4, f5 = f_src[3, x, y], f_src[4, x, y], f_src[5, x, y]
+            f6, f7, f8 = f_src[6, x, y], f_src[7, x, y], f_src[8, x, y]
+
+            cell_rho = f0 + f1 + f2 + f3 + f4 + f5 + f6 + f7 + f8
+            cell_ux = (f1 - f3 + f5 - f6 - f7 + f8) / cell_rho
+            cell_uy = (f2 - f4 + f5 + f6 - f7 - f8) / cell_rho
+            udotu = cell_ux * cell_ux + cell_uy * cell_uy
+
+            rho[x, y] = cell_rho
+            if wall[x, y]:
+                ux[x, y] = 0.0
+                uy[x, y] = 0.0
+            else:
+                ux[x, y] = cell_ux
+                uy[x, y] = cell_uy
+
+            for i in range(Q):
+                udotc = c[i, 0] * cell_ux + c[i, 1] * cell_uy
+                f_eq = real(w[i]) * cell_rho * (one + three * udotc +
+                                                four_half * udotc * udotc -
+                                                one_half * udotu)
+                f_eq_min = min(f_eq_min, f_eq)
+
+                f_post = f_src[i, x, y] * (one - inv_tau) + inv_tau * f_eq
+
+                # Periodic neighbour, without an integer division.
+                x_dst = x + c[i, 0]
+                if x_dst < 0:
+                    x_dst += width
+                elif x_dst == width:
+                    x_dst = 0
+
+                y_dst = y + c[i, 1]
+                if y_dst < 0:
+                    y_dst += height
+                elif y_dst == height:
+                    y_dst = 0
+
+                if wall[x_dst, y_dst]:
+                    f_dst[opp[i], x_dst, y_dst] = f_post
+                else:
+                    f_dst[i, x_dst, y_dst] = f_post
+
+    return f_eq_min
+
+
 class LBM:
-    def __init__(self, params, inlet_handler=None, outlet_handler=None):
+    def __init__(self, params, inlet_handler=None, outlet_handler=None,
+                 dtype=np.float32, debug=False, backend="numpy",
+                 render_every=1):
+        # Whether to check the stability condition on every iteration.
+        self.debug = debug
+
+        # Number of LBM iterations performed per rendered frame.
+        self.render_every = render_every
+
+        # Array module of the lattice: "numpy" runs the fused Numba kernel on
+        # the CPU, "cupy" runs the LBM step as array operations on the GPU.
+        assert backend in ("numpy", "cupy"), "Unknown backend"
+        self.backend = backend
+        if backend == "cupy":
+            import cupy as xp
+        else:
+            xp = np
+        self.xp = xp
+
+        # Floating point type of the lattice and the macroscopic quantities.
+        # float32 halves the memory traffic, use float64 for validation.
+        self.dtype = dtype
+
         # Get the map details
         self.width = self.height = params['size']
         self.map_scaling_factor = 1.0
@@ -31,6 +134,16 @@ class LBM:
 
         assert self.wall.shape == self.inlet.shape == self.outlet.shape
 
+        # Indices of the wall, inlet and outlet cells in the flattened grid.
+        self.wall_idx = xp.asarray(np.flatnonzero(self.wall))
+        self.inlet_idx = xp.asarray(np.flatnonzero(self.inlet))
+        self.outlet_idx = xp.asarray(np.flatnonzero(self.outlet))
+
+        # LBM constants as arrays of the backend.
+        self._cx = xp.asarray(c[:, 0], dtype=self.dtype)
+        self._cy = xp.asarray(c[:, 1], dtype=self.dtype)
+        self._w = xp.asarray(w, dtype=self.dtype)
+
         # Whether or not particles need to be simulated.
         self.simulate_particles = params['simulate_particles']
 
@@ -43,6 +156,16 @@ class LBM:
                 self.spawn_amount_at_rate
             self.particle_nr = 0
 
+            # Index of the closest susceptible centroid for every grid cell.
+            xx, yy = np.mgrid[:self.width, :self.height]
+            dist_2 = ((susceptible_centroids[:, 0, None, None] - xx)**2 +
+                      (susceptible_centroids[:, 1, None, None] - yy)**2)
+            self.nearest_centroid = np.argmin(dist_2, axis=0).astype(np.int8)
+
+            # Particles spawn at randomly chosen infected cells.
+            self.infected_indices = np.argwhere(self.infected)
+            self._rng = np.random.default_rng(params.get('seed'))
+
         self.inlet_handler = inlet_handler if inlet_handler is not None else \
             LBM.inlet_handler
         self.outlet_handler = outlet_handler if outlet_handler is not None \
@@ -68,14 +191,20 @@ class LBM:
         print()
 
         # Set the initial macroscopic quantities
-        self.rho = np.ones((self.width, self.height))
-        self.ux = np.full((self.width, self.height), 0.0)
-        self.uy = np.zeros((self.width, self.height))
+        self.rho = xp.ones((self.width, self.height), dtype=self.dtype)
+        self.ux = xp.full((self.width, self.height), 0.0, dtype=self.dtype)
+        self.uy = xp.zeros((self.width, self.height), dtype=self.dtype)
+
+        self.f = self.get_equilibrium(self.rho, self.ux, self.uy)
+        self.f_buf = xp.empty_like(self.f)
+
+        # Scratch space for bounce back, grown when needed.
+        self._bounce_scratch = xp.empty((2, 0), dtype=self.dtype)
 
-        self.f = self.get_equilibrium(self.width * self.height,
-                                      self.rho.flatten(), self.ux.flatten(),
-                                      self.uy.flatten()).reshape(
-            (self.width, self.height, Q))
+        # All inlet cells share the same equilibrium distribution, so it is
+        # only recomputed when u_lb changes.
+        self._inlet_u_lb = self.u_lb
+        self._inlet_feq = self._scalar_equilibrium(1.0, self.u_lb, 0.0)
 
         """Initialise the model based on a couple of physical values.
         """
@@ -94,6 +223,8 @@ class LBM:
         self.nu_lb = (self.u_lb * self.L_lb) / self.Re
 
         self.cssq = 1/3
+        self.inv_cssq = 1 / self.cssq
+        self.inv_2cssq2 = 1 / (2 * self.cssq**2)
         self.tau = self.nu_lb / self.cssq + 0.5
 
         """Initialise the model based on the known Reynolds number and other
@@ -114,37 +245,30 @@ class LBM:
         self.dt = self.Re * self.nu_lb / self.L_lb**2
 
         self.cssq = 1/3
+        self.inv_cssq = 1 / self.cssq
+        self.inv_2cssq2 = 1 / (2 * self.cssq**2)
         self.tau = self.nu_lb / self.cssq + 0.5
 
         """Read a map made by the map editor from a file.
         """
     def read_map_from_file(self, filename):
         with open(filename, 'r') as f:
-            iterator = enumerate(f)
-            _, firstline = next(iterator)
-            width, height = [int(x) for x in firstline.strip().split(',')]
+            width, height = [int(x) for x in f.readline().strip().split(',')]
             assert width == height, "Map width does not match map height"
             self.map_scaling_factor = self.width / width
 
-            wall = np.zeros((width, height), bool)
-            inlet = np.zeros((width, height), bool)
-            outlet = np.zeros((width, height), bool)
-            infected = np.zeros((width, height), bool)
-            susceptible = np.zeros((width, height), bool)
-
-            for i, line in iterator:
-                for j, c in enumerate(line.strip()):
-                    c = int(c)
-                    if c == WALL:
-                        wall[j, width-i] = True
-                    elif c == INLET:
-                        inlet[j, width-i] = True
-                    elif c == OUTLET:
-                        outlet[j, width-i] = True
-                    elif c == INFECTED:
-                        infected[j, width-i] = True
-                    elif c == SUSCEPTIBLE:
-                        susceptible[j, width-i] = True
+            data = ''.join(f.read().split()).encode()
+
+        # Convert the digits to cell types. The first line of the map is the
+        # top row of the grid.
+        cells = np.frombuffer(data, np.uint8) - ord('0')
+        cells = cells.reshape((height, width))[::-1].T
+
+        wall = cells == WALL
+        inlet = cells == INLET
+        outlet = cells == OUTLET
+        infected = cells == INFECTED
+        susceptible = cells == SUSCEPTIBLE
 
         # Resize all the arrays
         wall = cv2.resize(wall.astype('uint8'), (self.width, self.height),
@@ -162,73 +286,112 @@ class LBM:
 
         return wall, inlet, outlet, infected, susceptible
 
-        """Update the macroscopic quantities of the model and return them.
+        """Calculate the equilibrium values of the model and return them.
+
+        rho, ux and uy may be scalars or arrays of any (broadcastable) shape,
+        the result has an extra leading axis for the Q directions.
         """
-    def moment_update(f):
-        rho = np.sum(f, 2)
+    def get_equilibrium(self, rho, ux, uy):
+        xp = self.xp
+        rho, ux, uy = xp.broadcast_arrays(*(xp.asarray(v, dtype=self.dtype)
+                                            for v in (rho, ux, uy)))
 
-        ux = np.sum(c[:, 0] * f, axis=2) / rho
-        uy = np.sum(c[:, 1] * f, axis=2) / rho
+        # Shape of the constants to broadcast over the leading Q axis.
+        shape = (Q,) + (1,) * ux.ndim
+        udotu = ux * ux + uy * uy
+        udotc = (self._cx.reshape(shape) * ux +
+                 self._cy.reshape(shape) * uy)
 
-        return rho, ux, uy
+        return self._w.reshape(shape) * rho * (1 + udotc * self.inv_cssq +
+                                               udotc**2 * self.inv_2cssq2 -
+                                               0.5 * udotu * self.inv_cssq)
 
-        """Calculate the equilibrium values of the model and return them.
+        """Calculate the equilibrium values of a single cell and return them.
         """
-    def get_equilibrium(self, n, rho, ux, uy):
+    def _scalar_equilibrium(self, rho, ux, uy):
         udotu = ux * ux + uy * uy
+        udotc = self._cx * ux + self._cy * uy
 
-        udotc = np.zeros((n, Q), dtype=float)
-        for i in range(Q):
-            udotc[:, i] = ux * c[i, 0] + uy * c[i, 1]
+        f_eq = self._w * rho * (1 + udotc * self.inv_cssq +
+                                udotc**2 * self.inv_2cssq2 -
+                                0.5 * udotu * self.inv_cssq)
 
-        f_eq = np.zeros((n, 9), dtype=float)
-
-        for i in range(Q):
-            f_eq[:, i] = w[i] * rho * (1 + udotc[:, i] / self.cssq +
-                                       (udotc[:, i])**2 / (2 * self.cssq**2) -
-                                       udotu / (2 * self.cssq))
+        return f_eq.astype(self.dtype)
 
-        return f_eq
-
-        """Perform an iteration of the Lattice-Boltzmann method. Also checks
-        whether the model is stable.
+        """Perform an iteration of the Lattice-Boltzmann method. In debug mode
+        also checks whether the model is stable.
 
         Performs inlet and outlet handling according to the specified handlers.
         """
     def lbm_iteration(self, it):
+        # moment update, collision, streaming and bounce back
+        if self.backend == "numpy":
+            f_eq_min = lbm_step(self.f, self.f_buf, self.rho, self.ux,
+                                self.uy, self.wall, self.tau)
+            self.f, self.f_buf = self.f_buf, self.f
+        else:
+            f_eq_min = self.array_step()
+
+        # Check stability condition
+        if self.debug:
+            assert f_eq_min >= 0, "Simulation violated stability condition"
+
+        # Handle inlets and outlets. Note that "self.inlet_handler" does not
+        # necessarily refer to LBM.inlet_handler, it could also be a custom
+        # callback function provided by the user when initialising the model.
+        self.inlet_handler(self, it)
+        self.outlet_handler(self, it)
+
+        """Perform the moment update, collision, streaming and bounce back with
+        array operations of the backend, for backends that cannot run the
+        Numba kernel. Returns the minimum equilibrium value in debug mode.
+        """
+    def array_step(self):
+        xp = self.xp
+
         # moment update
-        self.rho, self.ux, self.uy = LBM.moment_update(self.f)
+        self.rho = self.f.sum(axis=0)
+        self.ux = xp.tensordot(self._cx, self.f, 1) / self.rho
+        self.uy = xp.tensordot(self._cy, self.f, 1) / self.rho
 
         # equilibrium
-        f_eq = self.get_equilibrium(self.width * self.height,
-                                    self.rho.flatten(), self.ux.flatten(),
-                                    self.uy.flatten()).reshape(
-                                       (self.width, self.height, Q))
-
-        # Check stability condition
-        assert np.min(f_eq) >= 0, f"Simulation violated stability \
-            condition at {np.unravel_index(np.argmin(f_eq), f_eq.shape)}"
+        f_eq = self.get_equilibrium(self.rho, self.ux, self.uy)
+        f_eq_min = f_eq.min() if self.debug else 0
 
         # collision
-        self.f = self.f * (1 - (1 / self.tau)) + (1 / self.tau) * f_eq
+        f_eq *= 1 / self.tau
+        f_eq += self.f * (1 - 1 / self.tau)
 
         # streaming
         for i in range(Q):
-            self.f[:, :, i] = np.roll(self.f[:, :, i], c[i], axis=(0, 1))
+            self.f_buf[i] = xp.roll(f_eq[i], (int(c[i, 0]), int(c[i, 1])),
+                                    axis=(0, 1))
+        self.f, self.f_buf = self.f_buf, self.f
 
         # bounce back
-        self.ux[self.wall] = 0
-        self.uy[self.wall] = 0
+        self.bounce_back(self.wall_idx)
 
-        boundary_f = self.f[self.wall, :]
-        boundary_f = boundary_f[:, [0, 3, 4, 1, 2, 7, 8, 5, 6]]
-        self.f[self.wall, :] = boundary_f
+        return f_eq_min
 
-        # Handle inlets and outlets. Note that "self.inlet_handler" does not
-        # necessarily refer to LBM.inlet_handler, it could also be a custom
-        # callback function provided by the user when initialising the model.
-        self.inlet_handler(self, it)
-        self.outlet_handler(self, it)
+        """Apply bounce back to the cells at the given indices of the flattened
+        grid, by reversing the direction of their populations.
+        """
+    def bounce_back(self, idx):
+        self.ux.reshape(-1)[idx] = 0
+        self.uy.reshape(-1)[idx] = 0
+
+        if len(idx) > self._bounce_scratch.shape[1]:
+            self._bounce_scratch = self.xp.empty((2, len(idx)),
+                                                 dtype=self.dtype)
+        f_a, f_b = self._bounce_scratch[:, :len(idx)]
+
+        # Swap the populations of every pair of opposite directions.
+        f = self.f.reshape(Q, -1)
+        for a, b in opp_pairs:
+            self.xp.take(f[a], idx, out=f_a)
+            self.xp.take(f[b], idx, out=f_b)
+            f[a, idx] = f_b
+            f[b, idx] = f_a
 
         """Calculate the values of the inlets based on the specified velocity.
         """
@@ -237,13 +400,12 @@ class LBM:
         The default inlet handler for an LBM model.
         """
         # Set the velocity vector at inlets
-        inlet_ux = model.u_lb
-        inlet_uy = 0.0
-        inlet_rho = np.ones_like(model.rho[model.inlet], dtype=float)
+        if model.u_lb != model._inlet_u_lb:
+            model._inlet_u_lb = model.u_lb
+            model._inlet_feq = model._scalar_equilibrium(1.0, model.u_lb, 0.0)
 
-        model.f[model.inlet] = model.get_equilibrium(len(inlet_rho),
-                                                     inlet_rho,
-                                                     inlet_ux, inlet_uy)
+        f = model.f.reshape(Q, -1)
+        f[:, model.inlet_idx] = model._inlet_feq[:, None]
 
     """Keep the values of the outlets constant, so no bounce back occurs
        and the fluid exits the computational domain.
@@ -254,12 +416,17 @@ class LBM:
         """
         # Set the density at outlets
         # outlet_rho = 0.9
-        outlet_rho = model.rho[model.outlet]
-        outlet_ux = model.ux[model.outlet]
-        outlet_uy = model.uy[model.outlet]
-        model.f[model.outlet] = model.get_equilibrium(len(outlet_ux),
-                                                      outlet_rho,
-                                                      outlet_ux, outlet_uy)
+        outlet_rho = model.rho.reshape(-1)[model.outlet_idx]
+        outlet_ux = model.ux.reshape(-1)[model.outlet_idx]
+        outlet_uy = model.uy.reshape(-1)[model.outlet_idx]
+        model.f.reshape(Q, -1)[:, model.outlet_idx] = model.get_equilibrium(
+            outlet_rho, outlet_ux, outlet_uy)
+
+        """Return an array of the backend as a NumPy array, for plotting and
+        particle tracking on the host.
+        """
+    def to_host(self, a):
+        return a if self.xp is np else self.xp.asnumpy(a)
 
         """Render the model.
 
@@ -280,28 +447,41 @@ class LBM:
         cbar = plt.colorbar(self.fluid_plot)
         cbar.set_label("Speed (units/steps)", rotation=270, labelpad=15)
 
+        # Buffer for the speed, which is computed in place every frame.
+        self._vals = self.xp.empty_like(self.ux)
+
+        # Frame information, drawn inside the axes so that it is updated
+        # when blitting.
+        self.info_text = ax.text(0.98, 0.98, "", transform=ax.transAxes,
+                                 ha="right", va="top", color="white")
+
+        self.centroid_labels = []
         if np.any(self.susceptible):
             # adding numbers at susceptible_centroids
             for idx, val in enumerate(susceptible_centroids):
                 x, y = val
-                plt.text(x, y, str(idx), fontsize=10, color='white')
+                self.centroid_labels.append(
+                    plt.text(x, y, str(idx), fontsize=10, color='white'))
 
         # Second layer: vector plot
         if vectors:
-            x, y = np.meshgrid(np.linspace(0, self.width-1, 20, dtype=int),
-                               np.linspace(0, self.height-1, 20, dtype=int))
-            u = self.ux[x, y]
-            v = self.uy[x, y]
+            # The grid of the vectors is reused for every frame.
+            self._qx, self._qy = np.meshgrid(
+                np.linspace(0, self.width-1, 20, dtype=int),
+                np.linspace(0, self.height-1, 20, dtype=int))
+            u = self.to_host(self.ux[self._qx, self._qy])
+            v = self.to_host(self.uy[self._qx, self._qy])
 
             # Set scale to 0.5 for lid driven cavity, 4 for Karman vortex
-            self.vector_plot = plt.quiver(x, y, u, v, scale=0.8)
+            self.vector_plot = plt.quiver(self._qx, self._qy, u, v, scale=0.8)
 
         # Third layer: particle plots
         if self.simulate_particles:
             self.particle_locations = np.zeros((self.num_particles, 2), float)
             self.particle_velocities = np.zeros((self.num_particles, 2), float)
-            self.particle_plots = [plt.plot(0, 0, 'ro', markersize=2)[0]
-                                   for i in range(self.num_particles)]
+            self.particle_plot = ax.scatter(np.zeros(self.num_particles),
+                                            np.zeros(self.num_particles),
+                                            s=4, c='red')
 
         # Fourth layer: map plot
         map_data = (WALL * self.wall + INLET * self.inlet +
@@ -327,20 +507,25 @@ class LBM:
         if self.simulate_particles:
             self.infections = np.zeros((NUM_SUSCEP_CENTROIDS, self.iters))
             self.removed = np.zeros((self.iters))
-            self.particles_exited = set()
-
+            self.exited = np.zeros(self.num_particles, bool)
+
+        # Number of iterations performed so far. Frames only advance the model
+        # up to their last iteration, so a repeated frame does not replay any
+        # steps. The last frame performs the remaining iterations if
+        # render_every does not divide the number of iterations.
+        self._sim_it = 0
+        num_frames = -(-self.iters // self.render_every)
         anim = FuncAnimation(fig, self.animate, interval=1,
-                             frames=range(1, self.iters),
+                             frames=range(num_frames), blit=True,
                              repeat=True, fargs=[ax, kind, vectors],
-                             init_func=lambda: self.animate(0, ax, kind,
-                                                            vectors))
+                             init_func=lambda: self._artists(vectors))
 
         if show_realtime:
             plt.show()
         elif save_file:
             anim.save("simulation.html", writer="html")
         else:
-            for i in range(self.iters):
+            for i in range(num_frames):
                 self.animate(i, ax, kind, vectors)
 
         if self.simulate_particles:
@@ -359,106 +544,137 @@ class LBM:
             ax.plot(removed_rate)
             fig.savefig('removed_rate.png')
 
-        """The animate function that is called for every step of the model.
+        """The animate function that is called for every frame of the model,
+        which performs the render_every steps of the model up to the end of
+        the frame.
+        Returns the artists that changed, for blitting.
         """
     def animate(self, it, ax, kind, vectors):
-        print("Running animate on iteration {} of {} of kind {}".format(it + 1,
-              self.iters, kind),
+        # Perform the LBM iterations of this frame and move the particles
+        end_it = min((it + 1) * self.render_every, self.iters)
+        while self._sim_it < end_it:
+            self.lbm_iteration(self._sim_it)
+
+            if self.simulate_particles:
+                self.update_particles(self._sim_it)
+
+            self._sim_it += 1
+
+        last_it = self._sim_it - 1
+        print("Running animate on iteration {} of {} of kind {}".format(
+              last_it + 1, self.iters, kind),
               end="\r")
-        # Perform an LBM iteration and update fluid plot
-        self.lbm_iteration(it)
 
-        vals = np.sqrt(self.ux**2 + self.uy**2) if kind == "mag" else self.rho
-        self.fluid_plot.set_data(vals.T)
+        # Update fluid plot
+        if kind == "mag":
+            vals = self.xp.hypot(self.ux, self.uy, out=self._vals)
+        else:
+            vals = self.rho
+        self.fluid_plot.set_data(self.to_host(vals).T)
 
         # Update the vector plot
         if vectors:
-            x, y = np.meshgrid(np.linspace(0, self.width-1, 20, dtype=int),
-                               np.linspace(0, self.height-1, 20, dtype=int))
-            u, v = self.ux[x, y], self.uy[x, y]
+            u = self.to_host(self.ux[self._qx, self._qy])
+            v = self.to_host(self.uy[self._qx, self._qy])
 
             self.vector_plot.set_UVC(u, v)
 
-        # Update particle locations and plots
+        # Update particle plots
+        if self.simulate_particles:
+            self.particle_plot.set_offsets(
+                self.particle_locations[:self.particle_nr])
+
+        # Update the frame information
+        self.info_text.set_text("{}, i={}, t={:.4f}s".format(
+            kind, last_it, last_it * self.dt))
+
+        return self._artists(vectors)
+
+        """Return the artists that are redrawn every frame, for blitting. This
+        is also the init function of the animation, so it must not perform
+        any steps of the model.
+        """
+    def _artists(self, vectors):
+        # The map and labels are drawn on top of the fluid plot, so they are
+        # redrawn as well.
+        artists = [self.fluid_plot, self.map_plot, *self.centroid_labels]
+
+        if vectors:
+            artists.append(self.vector_plot)
+
         if self.simulate_particles:
-            self.update_particles(it)
+            artists.append(self.particle_plot)
 
-            for i, loc in enumerate(self.particle_locations):
-                self.particle_plots[i].set_data(*loc)
+        artists.append(self.info_text)
 
-        # Update the plot title
-        ax.set_title("{}, i={}, t={:.4f}s".format(kind, it, it * self.dt))
+        return artists
 
         """Update the particles that move according to the velocities of the
         fluid.
         """
     def update_particles(self, it):
-        if it % self.spawn_rate == 0:
-            for _ in range(self.spawn_amount_at_rate):
-                # Spawn a new particle
-                # Randomly choose an infected cell.
-                if self.particle_nr < self.num_particles:
-                    infected_indices = np.where(self.infected)
+        if it % self.spawn_rate == 0 and self.particle_nr < self.num_particles:
+            # If there are no infected grid cells, then stop.
+            if len(self.infected_indices) == 0:
+                return
 
-                    # If there are no infected grid cells, then stop.
-                    if len(infected_indices[0]) == 0:
-                        return
+            # Spawn new particles at randomly chosen infected cells.
+            amount = min(self.spawn_amount_at_rate,
+                         self.num_particles - self.particle_nr)
+            idx = self._rng.integers(len(self.infected_indices), size=amount)
 
-                    idx = np.random.randint(len(infected_indices[0]))
+            start = self.particle_nr
+            self.particle_locations[start:start + amount] = \
+                self.infected_indices[idx]
+            self.particle_nr += amount
 
-                    self.particle_locations[self.particle_nr] = \
-                        infected_indices[0][idx], infected_indices[1][idx]
-                    self.particle_nr += 1
+        # Only particles that have not exited yet are updated.
+        n = self.particle_nr
+        locations = self.particle_locations[:n]
+        live = ~self.exited[:n]
 
-        # it > 0
-        ux_func = RegularGridInterpolator((np.arange(self.width),
-                                           np.arange(self.height)),
-                                          self.ux)
+        x_round = np.round(locations[:, 0]).astype(int)
+        y_round = np.round(locations[:, 1]).astype(int)
 
-        uy_func = RegularGridInterpolator((np.arange(self.width),
-                                           np.arange(self.height)),
-                                          self.uy)
+        # check whether particles intercepted a person or reached an outlet
+        hit = live & self.susceptible[x_round, y_round]
+        removed = live & ~hit & self.outlet[x_round, y_round]
+        moving = live & ~hit & ~removed
 
-        # Add the linearly interpolated velocity vector to the location of
-        # the point.
-        for i in range(self.particle_nr):
-            x, y = self.particle_locations[i]
-
-            if i in self.particles_exited:
-                continue
-
-            # check whether particle intercepted a person
-            if self.susceptible[int(round(x)), int(round(y))]:
-                # FIND CLOSEST NODE
-                node = int(x), int(y)
-                nodes = susceptible_centroids
-                dist_2 = np.sum((nodes - node)**2, axis=1)
-                closest = np.argmin(dist_2)
-
-                self.infections[closest][it] += 1
-
-                self.particles_exited.add(i)
-                self.particle_locations[i] = [0, 0]
-            elif self.outlet[int(round(x)), int(round(y))]:
-                self.removed[i] += 1
-                self.particles_exited.add(i)
-                self.particle_locations[i] = [0, 0]
-            else:
-                air_vx, air_vy = ux_func([x, y])[0], uy_func([x, y])[0]
-                part_vx, part_vy = self.particle_velocities[i]
+        # Find the closest susceptible centroid of every intercepting particle
+        nodes = locations[hit].astype(int)
+        closest = self.nearest_centroid[nodes[:, 0], nodes[:, 1]]
+        np.add.at(self.infections[:, it], closest, 1)
 
-                inertia = 0
-                new_part_vx = (air_vx * (1 - inertia) + part_vx * inertia)
-                new_part_vy = (air_vy * (1 - inertia) + part_vy * inertia)
+        self.removed[:n][removed] += 1
 
-                dx, dy = self.map_scaling_factor * new_part_vx, \
-                    self.map_scaling_factor * new_part_vy
-                # Keep particles inside boundaries
-                new_x = min(max(0, x + dx), self.width - 1)
-                new_y = min(max(0, y + dy), self.height - 1)
+        exited = hit | removed
+        self.exited[:n] |= exited
+        locations[exited] = 0
 
-                self.particle_locations[i] = [new_x, new_y]
-                self.particle_velocities[i] = [new_part_vx, new_part_vy]
+        # Add the linearly interpolated velocity vector to the location of
+        # the points.
+        x, y = locations[moving, 0], locations[moving, 1]
+        coords = np.stack((x, y))
+        air_vx = map_coordinates(self.to_host(self.ux), coords, order=1,
+                                 mode='nearest')
+        air_vy = map_coordinates(self.to_host(self.uy), coords, order=1,
+                                 mode='nearest')
+        part_vx, part_vy = self.particle_velocities[:n][moving].T
+
+        inertia = 0
+        new_part_vx = (air_vx * (1 - inertia) + part_vx * inertia)
+        new_part_vy = (air_vy * (1 - inertia) + part_vy * inertia)
+
+        dx, dy = self.map_scaling_factor * new_part_vx, \
+            self.map_scaling_factor * new_part_vy
+        # Keep particles inside boundaries
+        new_x = np.clip(x + dx, 0, self.width - 1)
+        new_y = np.clip(y + dy, 0, self.height - 1)
+
+        locations[moving] = np.stack((new_x, new_y), axis=1)
+        self.particle_velocities[:n][moving] = \
+            np.stack((new_part_vx, new_part_vy), axis=1)
 
 
 if __name__ == '__main__':
@@ -5,7 +5,7 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 
-from LBM import LBM
+from LBM import LBM, Q
 
 
 def lid_driven_cavity():
@@ -42,7 +42,8 @@ def validation():
         "u_lb": 0.2
     }
 
-    model = LBM(model_params)
+    # Run the validation in double precision, checking the stability.
+    model = LBM(model_params, dtype=np.float64, debug=True)
     model.render(kind="mag")
 
     nx = model_params['size']
@@ -124,10 +125,8 @@ def experiment1():
     end up infecting susceptible people?
     """
     def inlet_handler(model, inlet_ux):
-        inlet_rho = model.rho[model.inlet]
-
-        model.f[model.inlet] = LBM.LBM.get_equilibrium(
-            len(inlet_rho), model.rho[model.inlet], inlet_ux, 0.0)
+        model.f[:, model.inlet] = LBM.LBM.get_equilibrium(
+            model.rho[model.inlet], inlet_ux, 0.0)
 
     # First simulation: vary the inlet velocity from 0 to 0.5
     for i, inlet_ux in enumerate([0.2]):
@@ -175,39 +174,22 @@ def experiment2():
     def inlet_handler(model, it):
         if it % period_length < open_window_frac * period_length:
             # The windows are open, the inlet is acting like an actual inlet.
-            inlet_ux = model.u_lb
-            inlet_uy = 0.0
-            inlet_rho = np.ones_like(model.rho[model.inlet], dtype=float)
-
-            model.f[model.inlet] = model.get_equilibrium(len(inlet_rho),
-                                                         inlet_rho,
-                                                         inlet_ux, inlet_uy)
+            LBM.inlet_handler(model, it)
         else:
             # The windows are closed, the inlet is acting like a wall.
-            model.ux[model.inlet] = 0
-            model.uy[model.inlet] = 0
-
-            inlet_f = model.f[model.inlet, :]
-            inlet_f = inlet_f[:, [0, 3, 4, 1, 2, 7, 8, 5, 6]]
-            model.f[model.inlet, :] = inlet_f
+            model.bounce_back(model.inlet_idx)
 
     def outlet_handler(model, it):
         if it % period_length < open_window_frac * period_length:
             # The windows are open, the outlet is acting like an actual outlet.
             # Set the density at outlets
             outlet_rho = 0.9
-            outlet_ux = model.ux[model.outlet]
-            outlet_uy = model.uy[model.outlet]
-            model.f[model.outlet] = model.get_equilibrium(len(outlet_ux),
-                                                          outlet_rho,
-                                                          outlet_ux, outlet_uy)
+            outlet_ux = model.ux.reshape(-1)[model.outlet_idx]
+            outlet_uy = model.uy.reshape(-1)[model.outlet_idx]
+            model.f.reshape(Q, -1)[:, model.outlet_idx] = \
+                model.get_equilibrium(outlet_rho, outlet_ux, outlet_uy)
         else:
-            model.ux[model.outlet] = 0
-            model.uy[model.outlet] = 0
-
-            outlet_f = model.f[model.outlet, :]
-            outlet_f = outlet_f[:, [0, 3, 4, 1, 2, 7, 8, 5, 6]]
-            model.f[model.outlet, :] = outlet_f
+            model.bounce_back(model.outlet_idx)
 
 
 def experiment_realistic():
@@ -224,14 +206,20 @@ def experiment_realistic():
     }
 
     def inlet_handler(model, it):
-        inlet_ux = np.abs(model.u_lb * np.sin(2 * np.pi * (it / model_params['iterations'])))
-        inlet_uy = 0.0
-
-        inlet_rho = np.ones_like(model.rho[model.inlet], dtype=float)
-        model.f[model.inlet] = model.get_equilibrium(
-            len(inlet_rho), model.rho[model.inlet], inlet_ux, inlet_uy)
+        # The equilibrium is linear in the density, so only scale the
+        # precomputed distribution of this iteration.
+        inlet_rho = model.rho.reshape(-1)[model.inlet_idx]
+        model.f.reshape(Q, -1)[:, model.inlet_idx] = \
+            inlet_feq[:, it, None] * inlet_rho
 
     model = LBM(model_params, inlet_handler=inlet_handler)
+
+    # The inlet velocity follows a fixed schedule, so its equilibrium
+    # distribution at unit density is computed for all iterations at once.
+    t = np.arange(model.iters)
+    inlet_ux = np.abs(model.u_lb * np.sin(2 * np.pi * (t / model.iters)))
+    inlet_feq = model.get_equilibrium(1.0, inlet_ux, 0.0)
+
     model.render(kind="mag", show_realtime=False, save_file=True)
 
 